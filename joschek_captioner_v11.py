@@ -9,23 +9,73 @@ import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
 import subprocess
 import os
+import sys
 import shutil
 import threading
+import queue
 import signal
-import glob
-import base64
+import io
+import re
+import mmap
 import json
+import asyncio
+import hashlib
+import tempfile
+import multiprocessing
+from functools import partial
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from openai import OpenAI
+from urllib.parse import urlparse
+import httpx
+from openai import (AsyncOpenAI, APIConnectionError, APITimeoutError,
+                    InternalServerError, RateLimitError)
+from openai import _base_client as openai_base
 from PIL import Image, ImageTk
+try:
+    import pynvml
+except ImportError:
+    pynvml = None
+try:
+    from pybase64 import b64encode   # SIMD codec, same output as the stdlib
+except ImportError:
+    from base64 import b64encode
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import h2  # noqa: F401  (lets httpx negotiate HTTP/2 with https endpoints)
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
 
 # ---------------- CONFIG ----------------
 CONFIG_FILE = os.path.expanduser("~/.config/joschek_captioner.json")
+CACHE_DIR = os.path.expanduser("~/.cache/joschek_captioner")
+THUMB_DIR = os.path.join(CACHE_DIR, "thumbs")
+THUMB_CACHE_MAX = 500 * 1024 * 1024
+CAPTION_DIR = os.path.join(CACHE_DIR, "captions")
+CAPTION_CACHE_MAX = 200 * 1024 * 1024   # on disk, counted in filesystem blocks, not caption bytes
+THUMB_MEM_MAX = 256   # PhotoImages kept in RAM for the editor list
 DEFAULT_PORT = "11434"
 DEFAULT_CTX = "8192"
 DEFAULT_BATCH = "512"
 DEFAULT_GPU = "99"
+DEFAULT_CONCURRENCY = "8"   # match llama-server --parallel
+HTTP_POOL = 128             # upper bound for the Parallel field
 API_URL = f"http://localhost:{DEFAULT_PORT}/v1"
+CKPT_NAME = ".captioner_ckpt.jsonl"
+INDEX_NAME = ".captioner_index.json"   # {image name: [image mtime_ns, .txt mtime_ns] when captioned}
+MAX_TOKENS = 300
+IMG_EXTS = (".png", ".jpg", ".jpeg", ".webp", ".bmp")
+DEFAULT_MAX_SIDE = "1024"   # longest edge sent to the vision model
+JPEG_QUALITY = 85
+B64_CACHE_BYTES = 128 * 1024 * 1024   # encoded images kept in RAM between runs
+RETRY_ATTEMPTS = 3    # per image, for errors a busy or restarting server recovers from
+RETRY_ERRORS = (APIConnectionError, APITimeoutError, InternalServerError, RateLimitError)
+BREAKER_FAILS = 5     # consecutive failed requests before the batch is stopped
 DEFAULT_PROMPT = "Describe this image in detail for an AI training dataset. Focus on clothing, background, textures, and lighting."
 
 # ---------------- PALETTE ----------------
@@ -44,6 +94,9 @@ class Config:
     def __init__(self):
         self.config_dir = os.path.dirname(CONFIG_FILE)
         self.data = self.load()
+        self._lock = threading.Lock()
+        self._save_evt = threading.Event()
+        threading.Thread(target=self._save_worker, daemon=True).start()
     def load(self):
         try:
             os.makedirs(self.config_dir, exist_ok=True)
@@ -62,26 +115,310 @@ class Config:
             "last_prompt": DEFAULT_PROMPT
         }
     def save(self):
-        try:
-            os.makedirs(self.config_dir, exist_ok=True)
-            with open(CONFIG_FILE, "w") as f:
-                json.dump(self.data, f, indent=2)
-        except Exception as e:
-            print("Config save error:", e)
+        # never blocks the Tk loop; bursts collapse into one write on the worker
+        self._save_evt.set()
+    def save_now(self):
+        self._write()
+    def _save_worker(self):
+        while True:
+            self._save_evt.wait()
+            self._save_evt.clear()
+            self._write()
+    def _write(self):
+        with self._lock:
+            # snapshot under the lock: a write that started earlier can never land after a newer one
+            data = dict(self.data)
+            try:
+                os.makedirs(self.config_dir, exist_ok=True)
+                tmp = CONFIG_FILE + ".tmp"
+                with open(tmp, "w") as f:
+                    json.dump(data, f, indent=2)
+                os.replace(tmp, CONFIG_FILE)
+            except Exception as e:
+                print("Config save error:", e)
     def get(self, key, default=None):
         return self.data.get(key, default)
     def set(self, key, value):
-        self.data[key] = value
+        self.set_mem(key, value)
         self.save()
+    def set_mem(self, key, value):
+        # caller is responsible for a later save()
+        self.data[key] = value
+
+def iter_images(folder):
+    # dotfiles are skipped: macOS "._foo.jpg" AppleDouble files are not images
+    with os.scandir(folder) as it:
+        for e in it:
+            if not e.name.startswith(".") and e.name.lower().endswith(IMG_EXTS) and e.is_file():
+                yield e.path
+
+def scan_folder(folder):
+    # images plus a {stem: path} map of their .txt siblings, from one directory pass
+    imgs, txts = [], {}
+    with os.scandir(folder) as it:
+        for e in it:
+            name = e.name.lower()
+            if name.startswith("."):
+                continue
+            if name.endswith(".txt"):
+                txts[os.path.splitext(e.path)[0]] = e.path
+            elif name.endswith(IMG_EXTS) and e.is_file():
+                imgs.append(e.path)
+    return sorted(imgs), txts
+
+def caption_matches(path, kw, pat):
+    # pat is a bytes regex for ASCII keywords; anything else needs real case folding
+    if pat is None:
+        with open(path, encoding="utf-8") as f:
+            return kw in f.read().lower()
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if os.fstat(fd).st_size == 0:
+            return False
+        with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mm:
+            return pat.search(mm) is not None
+    finally:
+        os.close(fd)
+
+def prompt_hash(prompt):
+    return hashlib.sha1(prompt.encode()).hexdigest()
+
+def caption_key(img_path, prompt_sha):
+    # the first 64 KiB are enough to tell dataset images apart
+    with open(img_path, "rb") as f:
+        head = f.read(65536)
+    return hashlib.sha1(head).hexdigest() + ":" + prompt_sha
+
+def content_key(img_path, prompt_sha):
+    # the whole file: the caption cache is shared by every folder, where a 64 KiB head is not unique
+    # (large EXIF/XMP blocks, PNGs edited below their first rows)
+    h = hashlib.sha1()
+    buf = bytearray(1 << 20)
+    view = memoryview(buf)
+    with open(img_path, "rb") as f:
+        while n := f.readinto(buf):
+            h.update(view[:n])
+    return h.hexdigest() + ":" + prompt_sha
+
+def encode_image(path, max_side=int(DEFAULT_MAX_SIDE)):
+    # draft() lets libjpeg decode straight at 1/2, 1/4 or 1/8 scale
+    with Image.open(path) as im:
+        im.draft("RGB", (max_side, max_side))
+        im.thumbnail((max_side, max_side), Image.LANCZOS)
+        buf = io.BytesIO()
+        im.convert("RGB").save(buf, "JPEG", quality=JPEG_QUALITY, optimize=False)
+    # getbuffer() is a view, getvalue() would copy the whole JPEG first
+    with buf.getbuffer() as view:
+        return b64encode(view).decode("ascii")
+
+class GpuJpeg:
+    # NVJPEG decode and antialiased resize on the GPU; only the small RGB result is copied to the host.
+    # needs nvidia-nvimgcodec and torch with CUDA. Both are imported here, not at module level,
+    # so the spawned prep workers never load them
+    def __init__(self):
+        from nvidia import nvimgcodec
+        import torch
+        import torch.nn.functional as F
+        if not torch.cuda.is_available():
+            raise ImportError("torch has no CUDA device")
+        self.torch, self.F = torch, F
+        self.decoder = nvimgcodec.Decoder()
+        # the PIL path never applies EXIF orientation; the model has to see the same pixels here
+        self.params = nvimgcodec.DecodeParams(apply_exif_orientation=False,
+                                              color_spec=nvimgcodec.ColorSpec.RGB)
+        self.nv_image = None   # device buffer handed back to every decode that fits in it
+        self.reuse = True
+    def decode(self, path):
+        if self.reuse and self.nv_image is not None:
+            try:
+                return self.decoder.read(path, params=self.params, image=self.nv_image)
+            except TypeError:
+                self.reuse = False   # nvImageCodec without buffer reuse
+        return self.decoder.read(path, params=self.params)
+    def encode(self, path, max_side=int(DEFAULT_MAX_SIDE)):
+        nv = self.decode(path)
+        if nv is None:
+            raise ValueError("nvImageCodec could not decode the file")
+        if self.reuse:
+            self.nv_image = nv
+        t = self.torch.as_tensor(nv, device="cuda")   # HWC uint8 view of the decoded image, no copy
+        h, w = t.shape[:2]
+        scale = max_side / max(h, w)
+        if scale < 1:
+            size = (max(1, round(h * scale)), max(1, round(w * scale)))
+            x = t.permute(2, 0, 1).unsqueeze(0).float()
+            x = self.F.interpolate(x, size=size, mode="bilinear", antialias=True, align_corners=False)
+            t = x.squeeze(0).permute(1, 2, 0).round_().clamp_(0, 255).to(self.torch.uint8)
+        # the copy ends before the next decode reuses the buffer: everything runs on one thread
+        im = Image.fromarray(t.contiguous().cpu().numpy())
+        buf = io.BytesIO()
+        im.save(buf, "JPEG", quality=JPEG_QUALITY, optimize=False)
+        with buf.getbuffer() as view:
+            return b64encode(view).decode("ascii")
+
+def prune_thumb_cache(limit=THUMB_CACHE_MAX):
+    # least recently used thumbnails go first
+    try:
+        with os.scandir(THUMB_DIR) as it:
+            entries = [(e.stat().st_atime, e.stat().st_size, e.path) for e in it if e.is_file()]
+    except FileNotFoundError:
+        return
+    used = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if used <= limit:
+            break
+        try:
+            os.remove(path)
+            used -= size
+        except OSError:
+            pass
+
+def prune_caption_cache(limit=CAPTION_CACHE_MAX):
+    # least recently used captions go first; a hit touches its file, so atime works even with relatime
+    entries = []
+    try:
+        with os.scandir(CAPTION_DIR) as shards:
+            for shard in shards:
+                if not shard.is_dir():
+                    continue
+                with os.scandir(shard.path) as it:
+                    for e in it:
+                        if e.is_file():
+                            st = e.stat()
+                            entries.append((st.st_atime, getattr(st, "st_blocks", 0) * 512 or st.st_size, e.path))
+    except FileNotFoundError:
+        return
+    used = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if used <= limit:
+            break
+        try:
+            os.remove(path)
+            used -= size
+        except OSError:
+            pass
+
+def open_tmp_for(path):
+    # a private temp file next to path: concurrent writers never share one, dotfile so scans skip it
+    fd, tmp = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp",
+                               dir=os.path.dirname(path) or ".")
+    os.chmod(tmp, 0o644)   # mkstemp makes it 0600
+    return fd, tmp
+
+def write_atomic(path, text, fsync=True):
+    # a crash mid-write leaves the old file, never a truncated one
+    data = memoryview(text.encode("utf-8"))
+    fd, tmp = open_tmp_for(path)
+    try:
+        try:
+            while data:
+                data = data[os.write(fd, data):]
+            if fsync:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+def caption_cache_file(key, model):
+    h = hashlib.sha1(f"{key}:{model}".encode()).hexdigest()
+    return Path(CAPTION_DIR) / h[:2] / h
+
+def is_local_endpoint(url):
+    return urlparse(url).hostname in ("localhost", "127.0.0.1", "::1")
+
+def image_data_url(path, max_side, local, encode=encode_image):
+    # on loopback the payload size is free; decode + resize + re-encode is not.
+    # no path applies EXIF orientation, so the model sees the same pixels whichever one is taken
+    if local:
+        with Image.open(path) as im:   # lazy: only the header is parsed here
+            fmt, size = im.format, im.size
+        if fmt in ("JPEG", "PNG") and max(size) <= max_side:
+            buf = bytearray(os.path.getsize(path))
+            with open(path, "rb") as f:
+                f.readinto(buf)
+            return f"data:image/{fmt.lower()};base64,{b64encode(buf).decode('ascii')}"
+    return f"data:image/jpeg;base64,{encode(path, max_side)}"
+
+def load_checkpoint(path):
+    done = {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                    done[rec["key"]] = rec["caption"]
+                except (ValueError, KeyError):
+                    pass  # torn last line after a crash
+    except FileNotFoundError:
+        pass
+    return done
+
+def load_index(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return index if isinstance(index, dict) else {}
+
+def use_orjson_bodies():
+    # the request body is mostly one multi-MB base64 string; orjson serialises it far faster than json.
+    # the SDK encodes bodies itself through _base_client.openapi_dumps and hands httpx bytes, so that
+    # is the only place to hook; SDKs without it keep their own encoder
+    sdk_dumps = getattr(openai_base, "openapi_dumps", None)
+    if orjson is None or sdk_dumps is None:
+        return False
+    def dumps(obj):
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            return sdk_dumps(obj)  # pydantic models and the like: the SDK's encoder knows them
+    openai_base.openapi_dumps = dumps
+    return True
+
+use_orjson_bodies()
 
 # ---------------- WIDGETS ----------------
+def _on_wheel(e):
+    # one global handler; scroll whichever registered canvas is under the pointer
+    try:
+        w = e.widget.winfo_containing(e.x_root, e.y_root)
+    except (AttributeError, KeyError, tk.TclError):
+        return
+    while w is not None and not getattr(w, "wheel_scroll", False):
+        w = w.master
+    if w is None:
+        return
+    if e.num in (4, 5):                       # X11
+        step = -1 if e.num == 4 else 1
+    elif sys.platform == "darwin":
+        step = -e.delta
+    else:                                     # Windows: multiples of 120
+        step = -int(e.delta / 120) or (-1 if e.delta > 0 else 1)
+    w.yview_scroll(step, "units")
+
+def bind_wheel(canvas):
+    canvas.wheel_scroll = True
+    root = canvas.winfo_toplevel()
+    if not getattr(root, "wheel_bound", False):
+        for seq in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            root.bind_all(seq, _on_wheel)
+        root.wheel_bound = True
+
 class QueueItem(tk.Frame):
-    def __init__(self, parent, path, remove_cb, config):
+    def __init__(self, parent, path, remove_cb, config, save_cb):
         super().__init__(parent, bg=CARD)
         self.folder_path = path
         self.status = "pending"
         self.remove_cb = remove_cb
         self.config = config
+        self.save_cb = save_cb
         main = tk.Frame(self, bg=CARD)
         main.pack(fill="both", expand=True, padx=14, pady=10)
         header = tk.Frame(main, bg=CARD)
@@ -99,9 +436,13 @@ class QueueItem(tk.Frame):
         self.prompt = tk.Text(main, height=2, bg=INPUT, fg=TEXT, bd=0, relief="flat",
                               font=("Sans", 8), insertbackground=BLUE, wrap="word")
         self.prompt.insert("1.0", config.get("last_prompt", DEFAULT_PROMPT))
-        self.prompt.bind("<KeyRelease>", lambda e: config.set("last_prompt", self.get_prompt()))
+        self.prompt.bind("<KeyRelease>", self._on_prompt_key)
         self.prompt.pack(fill="x")
+    def _on_prompt_key(self, event=None):
+        self.config.set_mem("last_prompt", self.get_prompt())
+        self.save_cb()
     def set_status(self, state, msg=""):
+        self.status = state
         color = {"processing": BLUE, "done": GREEN, "error": RED}.get(state, DIM)
         self.status_lbl.config(text=msg, fg=color)
     def get_prompt(self):
@@ -118,7 +459,19 @@ class ScrollFrame(tk.Frame):
         canvas.configure(yscrollcommand=scrollbar.set)
         canvas.pack(side="left", fill="both", expand=True)
         scrollbar.pack(side="right", fill="y")
-        canvas.bind_all("<MouseWheel>", lambda e: canvas.yview_scroll(-1 if e.delta > 0 else 1, "units"))
+        bind_wheel(canvas)
+
+class FolderRun:
+    # one queue folder while the batch captions it; handed to every _caption_one of that folder
+    def __init__(self, item, idx, prompt, txts, ckpt_done, index, ckpt, total):
+        self.item, self.idx = item, idx
+        self.prompt = prompt
+        self.prompt_sha = prompt_hash(prompt)
+        self.txts = txts
+        self.ckpt_done = ckpt_done
+        self.index = index
+        self.ckpt = ckpt
+        self.done, self.total = 0, total
 
 # ---------------- MAIN APP ----------------
 class App:
@@ -131,11 +484,51 @@ class App:
         self.setup_styles()
         self.server_proc = None
         self.batch_running = False
+        self._batch_future = None
+        self._partial_owner = None    # loop thread: cancel event of the caption being shown
+        self._partial_cancel = None   # Tk thread: the same event, for the Skip button
         self.queue = []
-        self.client = None
+        # one event loop and one pooled HTTP client for the lifetime of the app
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        self._http = httpx.AsyncClient(
+            http2=HTTP2,
+            limits=httpx.Limits(max_connections=HTTP_POOL, max_keepalive_connections=HTTP_POOL),
+            timeout=httpx.Timeout(300.0, connect=5.0))
+        # retries happen in _request_caption, where Stop and the circuit breaker can see them
+        self.aclient = AsyncOpenAI(base_url=API_URL, api_key="sk-no-key", http_client=self._http,
+                                   max_retries=0)
+        self._local_api = is_local_endpoint(API_URL)
+        self._b64_cache = OrderedDict()   # (path, mtime_ns, size, max_side) -> data URL
+        self._b64_bytes = 0
+        self._prep_pool = self._new_prep_pool()
+        # JPEGs try the GPU first, on one thread: one CUDA context next to the model's, one decoder
+        self._gpu_pool = ThreadPoolExecutor(max_workers=1)
+        self._gpu = None   # GpuJpeg once set up, False when the GPU path is unavailable
         self.current_editor_folder = None
+        self.current_caption_file = None
         self.editor_items = []
+        self._selected_idx = None
         self.thumb_size = 128
+        self._row_h = self.thumb_size + 14
+        self._rows = {}
+        self._free_rows = []
+        self._thumb_pool = ThreadPoolExecutor(max_workers=8)
+        self._thumb_gen = 0
+        self._thumb_pending = {}
+        self._thumb_mem = OrderedDict()
+        self._log_q = queue.Queue()
+        # batch progress written by the loop thread, painted by _flush_ui at <=20 Hz
+        self._ui_state = {"status": {}, "log": deque()}   # + "pct" / "partial" while an update is pending
+        self._save_timer = None
+        self._cfg_timer = None
+        self._nv_handle = None
+        if pynvml:
+            try:
+                pynvml.nvmlInit()
+                self._nv_handle = pynvml.nvmlDeviceGetHandleByIndex(0)
+            except pynvml.NVMLError:
+                pass
         # notebook
         nb = ttk.Notebook(root)
         nb.pack(fill="both", expand=True)
@@ -152,6 +545,9 @@ class App:
         self.build_editor()
         self.build_filter()
         root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self._drain_log()
+        self._flush_ui()
+        self.poll_vram()
     # ---------------- STYLES (ELEGANT) ----------------
     def setup_styles(self):
         s = ttk.Style()
@@ -179,7 +575,7 @@ class App:
         for var, key in [(self.bin, "server_binary"), (self.model, "model_file"),
                          (self.proj, "projector_file"), (self.port, "port"),
                          (self.ctx, "context"), (self.gpu, "gpu_layers")]:
-            var.trace_add("write", lambda *_, v=var, k=key: self.config.set(k, v.get()))
+            var.trace_add("write", lambda *_, v=var, k=key: self.set_config(k, v.get()))
         self.detect_binary()
         for label, var, browse in [("Server Binary", self.bin, True),
                                    ("Model (.gguf)", self.model, True),
@@ -235,6 +631,16 @@ class App:
         tk.Checkbutton(tool, text="Overwrite", variable=self.overwrite, bg=BG, fg=TEXT,
                        selectcolor=INPUT, activebackground=BG, font=("Sans", 8),
                        highlightthickness=0).pack(side="right")
+        self.concurrency = tk.StringVar(value=self.config.get("concurrency", DEFAULT_CONCURRENCY))
+        self.concurrency.trace_add("write", lambda *_: self.set_config("concurrency", self.concurrency.get()))
+        tk.Entry(tool, textvariable=self.concurrency, bg=INPUT, fg=TEXT, bd=0, relief="flat", width=4,
+                 font=("Sans", 8), insertbackground=BLUE, justify="center").pack(side="right", ipady=5, padx=(4, 12))
+        tk.Label(tool, text="Parallel", bg=BG, fg=DIM, font=("Sans", 8)).pack(side="right")
+        self.max_side = tk.StringVar(value=self.config.get("max_side", DEFAULT_MAX_SIDE))
+        self.max_side.trace_add("write", lambda *_: self.set_config("max_side", self.max_side.get()))
+        tk.Entry(tool, textvariable=self.max_side, bg=INPUT, fg=TEXT, bd=0, relief="flat", width=5,
+                 font=("Sans", 8), insertbackground=BLUE, justify="center").pack(side="right", ipady=5, padx=(4, 12))
+        tk.Label(tool, text="Max edge", bg=BG, fg=DIM, font=("Sans", 8)).pack(side="right")
         self.queue_scroll = ScrollFrame(left)
         self.queue_scroll.pack(fill="both", expand=True)
         prog = tk.Frame(left, bg=BG)
@@ -243,6 +649,14 @@ class App:
         self.progress.pack(fill="x")
         self.prog_lbl = tk.Label(prog, text="Idle", bg=BG, fg=DIM, font=("Sans", 8))
         self.prog_lbl.pack(pady=(4, 0))
+        partial = tk.Frame(prog, bg=BG)
+        partial.pack(fill="x", pady=(4, 0))
+        self.btn_skip = self.btn(partial, "Skip", CARD, self.skip_caption)
+        self.btn_skip.config(state="disabled")
+        self.btn_skip.pack(side="right", anchor="n")
+        self.partial_lbl = tk.Label(partial, text="", bg=BG, fg=TEXT, font=("Sans", 8),
+                                    anchor="w", justify="left", wraplength=420)
+        self.partial_lbl.pack(side="left", fill="x", expand=True)
         right = tk.Frame(main, bg=BG)
         right.pack(side="right", fill="both", expand=True, padx=(15, 0))
         tk.Label(right, text="Processing Status", bg=BG, fg=TEXT, font=("Sans", 9)).pack(anchor="w", pady=(0, 5))
@@ -266,13 +680,12 @@ class App:
         img_frame = tk.Frame(left, bg=BG)
         img_frame.pack(fill="both", expand=True)
         self.img_canvas = tk.Canvas(img_frame, bg=INPUT, highlightthickness=0, bd=0)
-        img_scroll = ttk.Scrollbar(img_frame, orient="vertical", command=self.img_canvas.yview)
-        self.img_list_frame = tk.Frame(self.img_canvas, bg=INPUT)
-        self.img_list_frame.bind("<Configure>", lambda e: self.img_canvas.configure(scrollregion=self.img_canvas.bbox("all")))
-        self.img_canvas.create_window((0, 0), window=self.img_list_frame, anchor="nw")
-        self.img_canvas.configure(yscrollcommand=img_scroll.set)
+        self.img_scroll = ttk.Scrollbar(img_frame, orient="vertical", command=self.img_canvas.yview)
+        self.img_canvas.configure(yscrollcommand=self._on_img_yview)
+        self.img_canvas.bind("<Configure>", self._on_img_resize)
         self.img_canvas.pack(side="left", fill="both", expand=True)
-        img_scroll.pack(side="right", fill="y")
+        bind_wheel(self.img_canvas)
+        self.img_scroll.pack(side="right", fill="y")
         right = tk.Frame(content, bg=BG)
         right.pack(side="right", fill="both", expand=True, padx=(15, 0))
         tk.Label(right, text="Caption", bg=BG, fg=TEXT, font=("Sans", 8)).pack(anchor="w", pady=(0, 5))
@@ -328,21 +741,31 @@ class App:
         self.filter_log.config(state="normal")
         self.filter_log.delete("1.0", "end")
         self.filter_log.insert("end", f"Searching for keyword: {kw}\n")
-        for ext in ["*.png", "*.jpg", "*.jpeg", "*.webp", "*.bmp"]:
-            for img in glob.glob(os.path.join(src, ext)):
-                txt = os.path.splitext(img)[0] + ".txt"
-                if not os.path.isfile(txt):
-                    continue
+        imgs, txts = scan_folder(src)
+        pat = re.compile(re.escape(kw.encode()), re.IGNORECASE) if kw.isascii() else None
+        pairs = []
+        for img in imgs:
+            txt = txts.get(os.path.splitext(img)[0])
+            if txt is None:
+                continue
+            try:
+                if caption_matches(txt, kw, pat):
+                    pairs.append((img, txt))
+            except Exception as e:
+                self.filter_log.insert("end", f"error on {img}: {e}\n")
+        # same filesystem: a bare rename(2) per file, no shutil copy fallback
+        move = os.rename if os.stat(src).st_dev == os.stat(tgt).st_dev else shutil.move
+        def move_pair(img, txt):
+            base = os.path.basename(img)
+            move(img, os.path.join(tgt, base))
+            move(txt, os.path.join(tgt, os.path.basename(txt)))
+            return base
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            futs = [(img, pool.submit(move_pair, img, txt)) for img, txt in pairs]
+            for img, fut in futs:
                 try:
-                    with open(txt, encoding="utf-8") as f:
-                        content = f.read().lower()
-                    if kw in content:
-                        base = os.path.basename(img)
-                        base_txt = os.path.basename(txt)
-                        shutil.move(img, os.path.join(tgt, base))
-                        shutil.move(txt, os.path.join(tgt, base_txt))
-                        self.filter_log.insert("end", f"moved: {base}\n")
-                        matched += 1
+                    self.filter_log.insert("end", f"moved: {fut.result()}\n")
+                    matched += 1
                 except Exception as e:
                     self.filter_log.insert("end", f"error on {img}: {e}\n")
         self.filter_log.insert("end", f"Done. Moved {matched} pairs.\n")
@@ -351,9 +774,18 @@ class App:
     def editor_select_delta(self, delta):
         if not self.editor_items:
             return
-        idx = next((i for i, (_, f) in enumerate(self.editor_items) if f["bg"] == INPUT), 0)
+        idx = self._selected_idx if self._selected_idx is not None else 0
         new = max(0, min(len(self.editor_items) - 1, idx + delta))
-        self.editor_items[new][1].event_generate("<Button-1>")
+        self.select_editor_item(new)
+        # keep the keyboard selection inside the viewport
+        total = len(self.editor_items) * self._row_h
+        top = self.img_canvas.canvasy(0)
+        height = self.img_canvas.winfo_height()
+        y = new * self._row_h
+        if y < top:
+            self.img_canvas.yview_moveto(y / total)
+        elif y + self._row_h > top + height:
+            self.img_canvas.yview_moveto((y + self._row_h - height) / total)
     def load_editor_folder(self):
         path = None
         if shutil.which("zenity"):
@@ -369,49 +801,138 @@ class App:
             self.editor_folder_label.config(text=os.path.basename(path))
             self.load_editor_images()
     def load_editor_images(self):
-        for w in self.img_list_frame.winfo_children():
-            w.destroy()
-        self.editor_items = []
+        self.flush_caption()
         self.editor_text.delete("1.0", "end")
-        imgs = []
-        for ext in ["*.png", "*.jpg", "*.jpeg", "*.webp", "*.bmp"]:
-            imgs.extend(glob.glob(os.path.join(self.current_editor_folder, ext)))
-            imgs.extend(glob.glob(os.path.join(self.current_editor_folder, ext.upper())))
-        imgs.sort()
-        for img_path in imgs:
-            self.create_editor_item(img_path)
-    def create_editor_item(self, img_path):
-        item_frame = tk.Frame(self.img_list_frame, bg=CARD, cursor="hand2")
-        item_frame.pack(fill="x", pady=2, padx=2)
+        self.editor_items = sorted(iter_images(self.current_editor_folder))
+        self._selected_idx = None
+        # thumbnails still queued for the previous folder are dropped
+        self._thumb_gen += 1
+        for fut in self._thumb_pending.values():
+            fut.cancel()
+        self._thumb_pending = {}
+        for idx in list(self._rows):
+            self._release_row(idx)
+        self.img_canvas.configure(scrollregion=(0, 0, 0, len(self.editor_items) * self._row_h))
+        self.img_canvas.yview_moveto(0)
+        self.render_editor_rows()
+        self._thumb_pool.submit(prune_thumb_cache)
+    # ---------------- EDITOR LIST (VIRTUAL) ----------------
+    def _on_img_yview(self, first, last):
+        self.img_scroll.set(first, last)
+        self.render_editor_rows()
+    def _on_img_resize(self, event):
+        for row in list(self._rows.values()) + self._free_rows:
+            self.img_canvas.itemconfigure(row.win, width=max(1, event.width - 4))
+        self.render_editor_rows()
+    def render_editor_rows(self):
+        # only rows inside the viewport exist as widgets; rows are fixed-height so this is index math
+        n = len(self.editor_items)
+        top = self.img_canvas.canvasy(0)
+        bottom = top + self.img_canvas.winfo_height()
+        first = max(0, int(top) // self._row_h - 1)
+        last = min(n, int(bottom) // self._row_h + 2)
+        for idx in [i for i in self._rows if not first <= i < last]:
+            self._release_row(idx)
+        for idx in range(first, last):
+            if idx not in self._rows:
+                row = self._free_rows.pop() if self._free_rows else self._new_editor_row()
+                self._rows[idx] = row
+                self._fill_row(row, idx)
+        visible = set(self.editor_items[first:last])
+        for path in [p for p, f in self._thumb_pending.items() if p not in visible and f.cancel()]:
+            del self._thumb_pending[path]
+    def _new_editor_row(self):
+        row = tk.Frame(self.img_canvas, bg=CARD, cursor="hand2")
+        row.img_label = tk.Label(row, bg=CARD, fg=DIM)
+        row.img_label.pack(side="left", padx=5, pady=5)
+        row.name_label = tk.Label(row, bg=CARD, fg=TEXT, font=("Sans", 8), anchor="w")
+        row.name_label.pack(side="left", fill="x", expand=True, padx=5)
+        row.labels = (row.img_label, row.name_label)
+        for w in (row,) + row.labels:
+            w.bind("<Button-1>", lambda e, r=row: self.select_editor_item(r.idx))
+            w.bind("<Double-Button-1>", lambda e, r=row: self.show_zoom(self.editor_items[r.idx]))
+        row.win = self.img_canvas.create_window(2, 0, window=row, anchor="nw",
+                                                width=max(1, self.img_canvas.winfo_width() - 4),
+                                                height=self._row_h - 4)
+        return row
+    def _fill_row(self, row, idx):
+        row.idx = idx
+        path = self.editor_items[idx]
+        bg = INPUT if idx == self._selected_idx else CARD
+        row.config(bg=bg)
+        row.name_label.config(text=os.path.basename(path), bg=bg)
+        photo = self._thumb_mem.get(path)
+        if photo:
+            self._thumb_mem.move_to_end(path)
+            row.img_label.config(image=photo, text="", width=0, bg=bg)
+        else:
+            row.img_label.config(image="", text="[img]", width=10, bg=bg)
+            self._request_thumb(path)
+        self.img_canvas.coords(row.win, 2, idx * self._row_h + 2)
+        self.img_canvas.itemconfigure(row.win, state="normal")
+    def _release_row(self, idx):
+        row = self._rows.pop(idx)
+        self.img_canvas.itemconfigure(row.win, state="hidden")
+        self._free_rows.append(row)
+    def select_editor_item(self, idx):
+        self.load_caption_for_image(self.editor_items[idx])
+        prev, self._selected_idx = self._selected_idx, idx
+        # only the previous and the new row change colour
+        for i in (prev, idx):
+            row = self._rows.get(i)
+            if row is not None:
+                bg = INPUT if i == idx else CARD
+                row.config(bg=bg)
+                for lbl in row.labels:
+                    lbl.config(bg=bg)
+    def _request_thumb(self, img_path):
+        if img_path in self._thumb_pending:
+            return
+        fut = self._thumb_pool.submit(self._decode_thumb, img_path, self.thumb_size)
+        self._thumb_pending[img_path] = fut
+        fut.add_done_callback(lambda f, g=self._thumb_gen: self._thumb_done(g, f))
+    def _thumb_path(self, img_path, size):
+        key = f"{img_path}:{os.path.getmtime(img_path)}:{size}"
+        return os.path.join(THUMB_DIR, hashlib.sha1(key.encode()).hexdigest() + ".png")
+    def _decode_thumb(self, img_path, size):
+        tp = self._thumb_path(img_path, size)
         try:
-            img = Image.open(img_path)
-            img.thumbnail((self.thumb_size, self.thumb_size))
-            photo = ImageTk.PhotoImage(img)
-            img_label = tk.Label(item_frame, image=photo, bg=CARD)
-            img_label.image = photo
-            img_label.pack(side="left", padx=5, pady=5)
-        except:
-            img_label = tk.Label(item_frame, text="[img]", bg=CARD, fg=DIM, width=10)
-            img_label.pack(side="left", padx=5, pady=5)
-        name_label = tk.Label(item_frame, text=os.path.basename(img_path),
-                              bg=CARD, fg=TEXT, font=("Sans", 8), anchor="w")
-        name_label.pack(side="left", fill="x", expand=True, padx=5)
-        def select():
-            self.load_caption_for_image(img_path)
-            for w in self.img_list_frame.winfo_children():
-                w.config(bg=CARD)
-                for child in w.winfo_children():
-                    child.config(bg=CARD)
-            item_frame.config(bg=INPUT)
-            for child in item_frame.winfo_children():
-                if isinstance(child, tk.Label):
-                    child.config(bg=INPUT)
-        item_frame.bind("<Button-1>", lambda e: select())
-        for child in item_frame.winfo_children():
-            child.bind("<Button-1>", lambda e: select())
-        img_label.bind("<Double-Button-1>", lambda e: self.show_zoom(img_path))
-        name_label.bind("<Double-Button-1>", lambda e: self.show_zoom(img_path))
-        self.editor_items.append((img_path, item_frame))
+            with Image.open(tp) as img:
+                img = img.convert("RGB")
+            os.utime(tp)  # keep the LRU order honest on noatime mounts
+            return img_path, img.tobytes(), img.size
+        except (OSError, SyntaxError):
+            pass  # not cached yet, or a torn write
+        with Image.open(img_path) as img:
+            # JPEGs decode straight at 1/2..1/8 scale; a no-op for other formats
+            img.draft("RGB", (size * 2, size * 2))
+            img.thumbnail((size, size), Image.LANCZOS)
+            img = img.convert("RGB")
+        try:
+            os.makedirs(THUMB_DIR, exist_ok=True)
+            img.save(tp, "PNG", optimize=True)
+        except OSError as e:
+            print("Thumbnail cache error:", e)
+        return img_path, img.tobytes(), img.size
+    def _thumb_done(self, gen, fut):
+        if fut.cancelled() or fut.exception():
+            return
+        try:
+            self.root.after(0, self._place_thumb, gen, fut.result())
+        except (RuntimeError, tk.TclError):
+            pass  # window already closed
+    def _place_thumb(self, gen, result):
+        img_path, data, size = result
+        if gen != self._thumb_gen:
+            return
+        self._thumb_pending.pop(img_path, None)
+        photo = ImageTk.PhotoImage(Image.frombytes("RGB", size, data))
+        self._thumb_mem[img_path] = photo
+        if len(self._thumb_mem) > THUMB_MEM_MAX:
+            self._thumb_mem.popitem(last=False)
+        for row in self._rows.values():
+            if self.editor_items[row.idx] == img_path:
+                row.img_label.config(image=photo, text="", width=0)
     def show_zoom(self, img_path):
         if hasattr(self, "zoom_tl"):
             self.zoom_tl.destroy()
@@ -425,6 +946,7 @@ class App:
         tl.focus()
         tl.bind("<Escape>", lambda e: tl.destroy())
         img = Image.open(img_path)
+        img.draft("RGB", (960, 960))
         img.thumbnail((480, 480), Image.LANCZOS)
         ph = ImageTk.PhotoImage(img)
         lbl = tk.Label(tl, image=ph, bg=BG)
@@ -436,19 +958,43 @@ class App:
         self.zoom_tl = tl
     def load_caption_for_image(self, img_path):
         txt_path = os.path.splitext(img_path)[0] + ".txt"
+        self.flush_caption()
         self.current_caption_file = txt_path
+        try:
+            text = Path(txt_path).read_text(encoding="utf-8", errors="replace")
+        except FileNotFoundError:
+            text = ""
         self.editor_text.delete("1.0", "end")
-        if os.path.exists(txt_path):
-            with open(txt_path, encoding="utf-8") as f:
-                self.editor_text.insert("1.0", f.read())
+        self.editor_text.insert("1.0", text)
     def autosave_caption(self, event=None):
-        if hasattr(self, "current_caption_file"):
-            try:
-                content = self.editor_text.get("1.0", "end-1c")
-                with open(self.current_caption_file, "w", encoding="utf-8") as f:
-                    f.write(content)
-            except Exception as e:
-                print("Autosave error:", e)
+        # one write per 500 ms of idle instead of one per keystroke
+        if self.current_caption_file is None:
+            return
+        if self._save_timer:
+            self.root.after_cancel(self._save_timer)
+        self._save_timer = self.root.after(500, self._do_save)
+    def _do_save(self):
+        self._save_timer = None
+        try:
+            write_atomic(self.current_caption_file, self.editor_text.get("1.0", "end-1c"))
+        except Exception as e:
+            print("Autosave error:", e)
+    def flush_caption(self):
+        if self._save_timer:
+            self.root.after_cancel(self._save_timer)
+            self._do_save()
+    # ---------------- CONFIG ----------------
+    def set_config(self, key, value):
+        self.config.set_mem(key, value)
+        self.schedule_config_save()
+    def schedule_config_save(self):
+        # typing in a field rewrites the JSON once it settles, not per character
+        if self._cfg_timer:
+            self.root.after_cancel(self._cfg_timer)
+        self._cfg_timer = self.root.after(750, self._save_config)
+    def _save_config(self):
+        self._cfg_timer = None
+        self.config.save()
     # ---------------- GENERIC UI ----------------
     def field(self, parent, label, var, browse):
         f = tk.Frame(parent, bg=BG)
@@ -472,11 +1018,20 @@ class App:
             if os.path.exists(p):
                 self.bin.set(p)
                 break
+    def poll_vram(self):
+        self.update_vram_info()
+        # NVML is an in-process read; without it every refresh would fork nvidia-smi
+        if self._nv_handle:
+            self.root.after(2000, self.poll_vram)
     def update_vram_info(self):
         try:
-            used, total = map(int, subprocess.check_output(
-                ["nvidia-smi", "--query-gpu=memory.used,memory.total",
-                 "--format=csv,noheader,nounits"], stderr=subprocess.DEVNULL).decode().strip().split(","))
+            if self._nv_handle:
+                mem = pynvml.nvmlDeviceGetMemoryInfo(self._nv_handle)
+                used, total = mem.used >> 20, mem.total >> 20
+            else:
+                used, total = map(int, subprocess.check_output(
+                    ["nvidia-smi", "--query-gpu=memory.used,memory.total",
+                     "--format=csv,noheader,nounits"], stderr=subprocess.DEVNULL).decode().strip().split(","))
             free, percent = total - used, (used / total) * 100
             color = GREEN if percent < 50 else (BLUE if percent < 80 else RED)
             self.vram_label.config(text=f"VRAM: {used}MB used / {free}MB free / {total}MB total ({percent:.0f}%)", fg=color)
@@ -486,9 +1041,12 @@ class App:
         if not messagebox.askyesno("Kill GPU Processes", "Terminate ALL GPU processes?"):
             return
         try:
-            pids = map(int, subprocess.check_output(
-                ["nvidia-smi", "--query-compute-apps=pid", "--format=csv,noheader"],
-                stderr=subprocess.DEVNULL).decode().strip().split())
+            if self._nv_handle:
+                pids = [p.pid for p in pynvml.nvmlDeviceGetComputeRunningProcesses(self._nv_handle)]
+            else:
+                pids = map(int, subprocess.check_output(
+                    ["nvidia-smi", "--query-compute-apps=pid", "--format=csv,noheader"],
+                    stderr=subprocess.DEVNULL).decode().strip().split())
             killed = 0
             for pid in pids:
                 try:
@@ -496,7 +1054,7 @@ class App:
                     killed += 1
                 except:
                     pass
-            threading.Timer(1.0, self.update_vram_info).start()
+            self.root.after(1000, self.update_vram_info)
             messagebox.showinfo("GPU Processes", f"Killed {killed} process(es).")
         except Exception as e:
             messagebox.showerror("Error", f"Failed to kill GPU processes:\n{e}")
@@ -525,7 +1083,7 @@ class App:
         try:
             self.server_proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
                                                stderr=subprocess.STDOUT, text=True,
-                                               bufsize=1, preexec_fn=os.setsid)
+                                               bufsize=1, start_new_session=True)
             self.btn_start.config(state="disabled", bg=CARD)
             self.btn_stop.config(state="normal", bg=RED)
             threading.Thread(target=self.watch_server, daemon=True).start()
@@ -535,19 +1093,34 @@ class App:
         if self.server_proc:
             try:
                 os.killpg(os.getpgid(self.server_proc.pid), signal.SIGTERM)
-                threading.Thread(target=self.server_proc.wait, daemon=True).start()
+                self.root.after(200, self._poll_reaper, self.server_proc)
             except Exception as e:
                 self.log.insert("end", f"Stop error: {e}\n")
         self.root.after(100, self.reset_ui)
+    def _poll_reaper(self, proc):
+        # reap the exited server from the Tk loop instead of parking a thread in wait()
+        if proc.poll() is None:
+            self.root.after(200, self._poll_reaper, proc)
     def watch_server(self):
         try:
             for line in iter(self.server_proc.stdout.readline, ""):
                 if line:
-                    self.log.insert("end", line)
-                    self.log.see("end")
+                    self._log_q.put(line)
         except Exception:
             pass
         self.root.after(0, self.reset_ui)
+    def _drain_log(self):
+        # Tk is not thread-safe: watch_server only queues, the main loop inserts in bulk
+        lines = []
+        try:
+            while True:
+                lines.append(self._log_q.get_nowait())
+        except queue.Empty:
+            pass
+        if lines:
+            self.log.insert("end", "".join(lines))
+            self.log.see("end")
+        self.root.after(50, self._drain_log)
     def reset_ui(self):
         self.btn_start.config(state="normal", bg=GREEN)
         self.btn_stop.config(state="disabled", bg=CARD)
@@ -564,7 +1137,8 @@ class App:
         if not path:
             path = filedialog.askdirectory()
         if path:
-            item = QueueItem(self.queue_scroll.content, path, self.remove_item, self.config)
+            item = QueueItem(self.queue_scroll.content, path, self.remove_item, self.config,
+                             self.schedule_config_save)
             item.pack(fill="x", pady=(0, 6))
             self.queue.append(item)
     def remove_item(self, item):
@@ -578,14 +1152,16 @@ class App:
         self.status_log.see("end")
         self.status_log.config(state="disabled")
     def toggle_batch(self):
-        if self.batch_running:
-            self.batch_running = False
-            self.btn_proc.config(text="Start Processing", bg=GREEN)
-            self.prog_lbl.config(text="Stopping...")
+        if self._batch_future and not self._batch_future.done():
+            if self.batch_running:
+                # the run puts the button back once in-flight requests have drained
+                self.batch_running = False
+                self.btn_proc.config(text="Stopping...")
+                self.prog_lbl.config(text="Stopping...")
         else:
             try:
-                self.client = OpenAI(base_url=API_URL, api_key="sk-no-key")
-                self.client.models.list()
+                # also warms the connection pool before the batch starts
+                asyncio.run_coroutine_threadsafe(self._ping_server(), self.loop).result(timeout=10)
             except Exception as e:
                 messagebox.showerror("Connection Error", f"Cannot connect to server.\n{e}")
                 return
@@ -594,64 +1170,357 @@ class App:
             self.status_log.config(state="disabled")
             self.batch_running = True
             self.btn_proc.config(text="Stop Processing", bg=RED)
-            threading.Thread(target=self.run_batch, daemon=True).start()
-    def run_batch(self):
+            self._batch_future = asyncio.run_coroutine_threadsafe(self._run_batch_async(), self.loop)
+    def skip_caption(self):
+        # cancels only the caption shown in the partial line, the batch goes on
+        if self._partial_cancel:
+            self._partial_cancel.set()
+            self.btn_skip.config(state="disabled")
+    async def _ping_server(self):
+        await self.aclient.models.list()
+    async def _run_batch_async(self):
+        # nobody awaits this coroutine's future: whatever happens, the UI has to leave batch mode
+        label = "Idle"
+        try:
+            label = await self._run_batch()
+        except Exception as e:
+            self._post_log(f"✗ Batch aborted: {e!r}")
+            label = "Batch aborted"
+        finally:
+            self.batch_running = False
+            self.root.after(0, partial(self.btn_proc.config, text="Start Processing", bg=GREEN))
+            self.root.after(0, partial(self.prog_lbl.config, text=label))
+            try:
+                self._thumb_pool.submit(prune_caption_cache)
+            except RuntimeError:
+                pass  # app is closing, the pool is already shut down
+    async def _run_batch(self):
         total = len(self.queue)
         if total == 0:
-            self.batch_running = False
-            self.root.after(0, lambda: self.btn_proc.config(text="Start Processing", bg=GREEN))
-            self.root.after(0, lambda: self.prog_lbl.config(text="No folders in queue"))
-            return
-        for idx, item in enumerate(self.queue):
+            return "No folders in queue"
+        try:
+            limit = min(max(1, int(self.concurrency.get())), HTTP_POOL)
+        except ValueError:
+            limit = int(DEFAULT_CONCURRENCY)
+        self._pct_scale, self._last_pct = 100 / total, -1
+        self._consec_fail = 0
+        # Tk variables are read once per batch, not once per image from the loop thread
+        self._model_name = os.path.basename(self.model.get())
+        self._overwrite = self.overwrite.get()
+        sem = asyncio.Semaphore(limit)
+        self._prep_sem = asyncio.Semaphore(limit + 2)
+        try:
+            self._max_side = max(64, int(self.max_side.get()))
+        except ValueError:
+            self._max_side = int(DEFAULT_MAX_SIDE)
+        for idx, item in enumerate(list(self.queue)):
             if not self.batch_running:
                 break
-            self.root.after(0, lambda i=item: i.set_status("processing", "Scanning..."))
-            imgs = []
-            for ext in ["*.png", "*.jpg", "*.jpeg", "*.webp", "*.bmp"]:
-                imgs.extend(glob.glob(os.path.join(item.folder_path, ext)))
-                imgs.extend(glob.glob(os.path.join(item.folder_path, ext.upper())))
-            total_imgs = len(imgs)
-            done = 0
-            for img in imgs:
-                if not self.batch_running:
-                    break
-                txt = os.path.splitext(img)[0] + ".txt"
-                if os.path.exists(txt) and not self.overwrite.get():
-                    done += 1
+            # folders removed from the queue since Start are skipped, their widgets are gone
+            try:
+                if item not in self.queue or not item.winfo_exists():
                     continue
-                try:
-                    prompt = item.get_prompt() or DEFAULT_PROMPT
-                    with open(img, "rb") as f:
-                        img_b64 = base64.b64encode(f.read()).decode()
-                    resp = self.client.chat.completions.create(
-                        model=os.path.basename(self.model.get()),
+                # one prompt per folder: read and hash it here, not once per image
+                prompt = item.get_prompt() or DEFAULT_PROMPT
+            except tk.TclError:
+                continue
+            self._post_status(item, "processing", "Scanning...")
+            ckpt_path = os.path.join(item.folder_path, CKPT_NAME)
+            index_path = os.path.join(item.folder_path, INDEX_NAME)
+            try:
+                imgs, txts = scan_folder(item.folder_path)
+                # foo.jpg and foo.png share foo.txt: caption the first, as a sequential run would
+                stems, unique = set(), []
+                for img in imgs:
+                    stem = img.rpartition(".")[0]
+                    if stem in stems:
+                        self._post_log(f"⤼ {os.path.basename(img)}: shares its .txt with another image")
+                        continue
+                    stems.add(stem)
+                    unique.append(img)
+                imgs = unique
+                with open(ckpt_path, "a", encoding="utf-8") as ckpt:
+                    run = FolderRun(item, idx, prompt, txts, load_checkpoint(ckpt_path),
+                                    load_index(index_path), ckpt, len(imgs))
+                    results = await asyncio.gather(*[self._caption_one(run, sem, img) for img in imgs],
+                                                   return_exceptions=True)
+                # also after Stop, so the next run knows which captions are current
+                write_atomic(index_path, json.dumps(run.index), fsync=False)
+            except OSError as e:
+                self._post_log(f"✗ {e}")
+                self._post_status(item, "error", "Folder error")
+                continue
+            # _caption_one logs its own failures; anything here is a bug, but must not kill the batch
+            for img, res in zip(imgs, results):
+                if isinstance(res, Exception):
+                    self._post_log(f"✗ {os.path.basename(img)}: {res!r}")
+            self._post_status(item, *(("done", "Complete") if self.batch_running else ("error", "Stopped")))
+        return "Idle"
+    async def _caption_one(self, run, sem, img):
+        stem = img.rpartition(".")[0]
+        txt = stem + ".txt"
+        img_name = img.rpartition(os.sep)[2]
+        # existing captions come from the folder scan; only images the index knows are stat()ed,
+        # and those are redone when the file changed after it was captioned
+        stale = False
+        if run.txts.get(stem) == txt and not self._overwrite:
+            seen = run.index.get(img_name)
+            try:
+                if seen is not None:
+                    img_mtime, txt_mtime = seen if isinstance(seen, list) else (seen, None)
+                    stale = img_mtime != os.stat(img).st_mtime_ns
+                    if stale and txt_mtime is not None and txt_mtime != os.stat(txt).st_mtime_ns:
+                        # the caption was edited after we wrote it: the user's text wins
+                        self._post_log(f"⤼ {img_name}: image changed, keeping the edited caption")
+                        stale = False
+            except OSError:
+                stale = False
+            if not stale:
+                run.done += 1
+                self._post_progress(run)
+                return
+            self._post_log(f"↻ {img_name}: image changed since it was captioned, redoing")
+        # a changed image goes straight to the server: the checkpoint key only hashes the file's head,
+        # so an edit below it would bring the old caption back
+        reuse = not (self._overwrite or stale)
+        try:
+            key = caption_key(img, run.prompt_sha)
+            if reuse and key in run.ckpt_done:
+                # finished in an earlier run, only the .txt went missing
+                write_atomic(txt, run.ckpt_done[key], fsync=False)
+                run.index[img_name] = [os.stat(img).st_mtime_ns, os.stat(txt).st_mtime_ns]
+                run.done += 1
+                self._post_log(f"↺ {img_name}")
+                self._post_progress(run)
+                return
+            cache_file = caption_cache_file(content_key(img, run.prompt_sha), self._model_name)
+            if reuse and cache_file.exists():
+                # same image bytes, prompt and model were captioned before, maybe in another folder
+                self._store_caption(run, img, txt, key, cache_file.read_text(encoding="utf-8"))
+                os.utime(cache_file)   # recently used for prune_caption_cache
+                self._post_log(f"✓ {img_name} (cached)")
+                self._post_progress(run)
+                return
+        except Exception as e:
+            self._post_log(f"✗ {img_name}: {e}")
+            self._post_progress(run)
+            return
+        # prep_sem > sem: while every slot is busy, the next images are already being encoded
+        async with self._prep_sem:
+            if not self.batch_running:
+                return
+            try:
+                img_url = await self._image_url(img)
+                caption = await self._request_caption(sem, run.prompt, img_url, img_name, txt)
+                if caption is None:
+                    self._post_progress(run)
+                    return
+                self._consec_fail = 0
+                self._store_caption(run, img, txt, key, caption, written=True)
+                cache_file.parent.mkdir(parents=True, exist_ok=True)
+                write_atomic(cache_file, caption, fsync=False)
+                self._post_log(f"✓ {img_name}")
+            except Exception as e:
+                self._post_log(f"✗ {img_name}: {e}")
+                # only a server that is down or overloaded counts: a 400 for one bad image is not
+                if isinstance(e, RETRY_ERRORS):
+                    self._request_failed(e)
+        self._post_progress(run)
+    async def _request_caption(self, sem, prompt, img_url, img_name, txt):
+        # tokens go into a temp file as they arrive and it replaces txt once the stream is complete.
+        # returns None on Stop or Skip; transient server errors are retried with backoff
+        cancel = threading.Event()   # Skip sets it while this caption is the one shown
+        for attempt in range(RETRY_ATTEMPTS):
+            fd = None
+            try:
+                async with sem:
+                    if not self.batch_running:
+                        return None
+                    stream = await self.aclient.chat.completions.create(
+                        model=self._model_name,
                         messages=[{"role": "user", "content": [
                             {"type": "text", "text": prompt},
-                            {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{img_b64}"}}
+                            {"type": "image_url", "image_url": {"url": img_url}}
                         ]}],
-                        max_tokens=300
+                        max_tokens=MAX_TOKENS,
+                        stream=True
                     )
-                    with open(txt, "w", encoding="utf-8") as f:
-                        f.write(resp.choices[0].message.content.strip())
-                    done += 1
-                    img_name = os.path.basename(img)
-                    self.root.after(0, lambda name=img_name: self.log_status(f"✓ {name}"))
-                except Exception as e:
-                    img_name = os.path.basename(img)
-                    self.root.after(0, lambda name=img_name, err=str(e): self.log_status(f"✗ {name}: {err}"))
-                pct = int(((idx + (done / total_imgs)) / total) * 100) if total_imgs > 0 else 0
-                self.root.after(0, lambda p=pct: self.progress.configure(value=p))
-                self.root.after(0, lambda d=done, t=total_imgs, i=item:
-                               i.set_status("processing", f"{d}/{t}"))
-            self.root.after(0, lambda i=item, r=self.batch_running:
-                           i.set_status("done" if r else "error", "Complete" if r else "Stopped"))
+                    fd, tmp = open_tmp_for(txt)
+                    parts = []
+                    held = ""   # trailing whitespace is only written once more text follows it
+                    next_post = 0.0
+                    async for chunk in stream:
+                        if not self.batch_running or cancel.is_set():
+                            break
+                        if not (chunk.choices and chunk.choices[0].delta.content):
+                            continue
+                        delta = chunk.choices[0].delta.content
+                        if not parts:
+                            delta = delta.lstrip()
+                            if not delta:
+                                continue
+                        parts.append(delta)
+                        text = held + delta
+                        body = text.rstrip()
+                        held = text[len(body):]
+                        if body:
+                            os.write(fd, body.encode("utf-8"))
+                        # one caption is shown at a time, repainted at most ten times a second
+                        if self._partial_owner in (None, cancel) and self.loop.time() >= next_post:
+                            self._partial_owner = cancel
+                            self._ui_state["partial"] = (img_name, "".join(parts), cancel)
+                            next_post = self.loop.time() + 0.1
+                    if not self.batch_running or cancel.is_set():
+                        # Stop or Skip mid-caption: drop the connection, the server frees the slot
+                        await stream.close()
+                        if cancel.is_set():
+                            self._post_log(f"⤼ {img_name}: skipped")
+                        return None
+                    os.close(fd)
+                    fd = None
+                    os.replace(tmp, txt)
+                    return "".join(parts).strip()
+            except RETRY_ERRORS as e:
+                if attempt == RETRY_ATTEMPTS - 1 or not self.batch_running:
+                    raise
+                self._post_log(f"… {img_name}: {e}, retrying")
+            finally:
+                if self._partial_owner is cancel:
+                    self._partial_owner = None
+                    self._ui_state["partial"] = ()
+                # anything but a completed stream leaves no half-written caption behind
+                if fd is not None:
+                    os.close(fd)
+                    try:
+                        os.remove(tmp)
+                    except OSError:
+                        pass
+            # back off outside the semaphore so healthy requests keep the slot
+            await asyncio.sleep(min(10, 2 ** attempt))
+    def _request_failed(self, err):
+        # a dead server would otherwise fail every remaining image one by one
+        self._consec_fail += 1
+        if self._consec_fail < BREAKER_FAILS or not self.batch_running:
+            return
         self.batch_running = False
-        self.root.after(0, lambda: self.btn_proc.config(text="Start Processing", bg=GREEN))
-        self.root.after(0, lambda: self.prog_lbl.config(text="Idle"))
+        self._post_log(f"✗ {self._consec_fail} requests failed in a row, batch stopped")
+        self.root.after(0, partial(messagebox.showerror, "Batch stopped",
+                                   f"{self._consec_fail} requests failed in a row.\n{err}"))
+    def _post_progress(self, run):
+        pct = int((run.idx + run.done / run.total) * self._pct_scale)
+        if pct != self._last_pct:
+            self._last_pct = self._ui_state["pct"] = pct
+        self._post_status(run.item, "processing", f"{run.done}/{run.total}")
+    def _post_log(self, msg):
+        self._ui_state["log"].append(msg)
+    def _post_status(self, item, state, msg):
+        self._ui_state["status"][item] = (state, msg)
+    def _flush_ui(self):
+        # one paint per tick however many captions finished since the last one
+        st = self._ui_state
+        lines = []
+        while st["log"]:
+            lines.append(st["log"].popleft())
+        if lines:
+            self.log_status("\n".join(lines))
+        # pop() takes the value and clears the slot in one step, a newer write is never lost
+        pct = st.pop("pct", None)
+        if pct is not None:
+            self.progress.configure(value=pct)
+        partial = st.pop("partial", None)   # () clears the line
+        if partial is not None:
+            name, text, self._partial_cancel = partial or ("", "", None)
+            self.partial_lbl.config(text=f"{name}: {text[-300:]}" if name else "")
+            self.btn_skip.config(state="normal" if self._partial_cancel else "disabled")
+        for item in list(st["status"]):
+            try:
+                item.set_status(*st["status"].pop(item))
+            except tk.TclError:
+                pass  # folder was removed from the queue meanwhile
+        self.root.after(50, self._flush_ui)
+    def _new_prep_pool(self):
+        # decode + resize + JPEG encode holds the GIL in PIL's glue; worker processes use every core.
+        # spawn, not fork: forking a process that runs Tk and several threads is unsafe
+        return ProcessPoolExecutor(max_workers=os.cpu_count() or 1,
+                                   mp_context=multiprocessing.get_context("spawn"))
+    def _gpu_encode(self, path, max_side):
+        # GPU thread only; the optional imports are paid here on first use, not at startup
+        if self._gpu is None:
+            try:
+                self._gpu = GpuJpeg()
+            except ImportError:
+                self._gpu = False
+            except Exception as e:
+                self._gpu = False
+                self._post_log(f"GPU JPEG decode unavailable, using PIL: {e}")
+        if not self._gpu:
+            raise ImportError("GPU JPEG decode unavailable")
+        return self._gpu.encode(path, max_side)
+    async def _gpu_image_url(self, img):
+        try:
+            return await self.loop.run_in_executor(self._gpu_pool, image_data_url, img,
+                                                   self._max_side, self._local_api, self._gpu_encode)
+        except Exception:
+            return None   # no GPU path, or a JPEG nvImageCodec cannot handle (CMYK, ...): PIL takes it
+    async def _image_url(self, img):
+        # reruns and retries skip the read + resize + base64 of unchanged files
+        st = os.stat(img)
+        key = (img, st.st_mtime_ns, st.st_size, self._max_side)
+        url = self._b64_cache.get(key)
+        if url is not None:
+            self._b64_cache.move_to_end(key)
+            return url
+        url = None
+        if self._gpu is not False and img.lower().endswith((".jpg", ".jpeg")):
+            url = await self._gpu_image_url(img)
+        if url is None:
+            url = await self._cpu_image_url(img)
+        self._b64_cache[key] = url
+        self._b64_bytes += len(url)
+        while self._b64_bytes > B64_CACHE_BYTES and len(self._b64_cache) > 1:
+            _, old = self._b64_cache.popitem(last=False)
+            self._b64_bytes -= len(old)
+        return url
+    async def _cpu_image_url(self, img):
+        pool = self._prep_pool
+        try:
+            return await self.loop.run_in_executor(pool, image_data_url, img, self._max_side, self._local_api)
+        except BrokenProcessPool:
+            # a worker died (codec crash, OOM killer) and took the pool with it; the first image
+            # to notice replaces it, then this one is tried once more
+            if self._prep_pool is pool:
+                pool.shutdown(wait=False, cancel_futures=True)
+                self._prep_pool = self._new_prep_pool()
+            return await self.loop.run_in_executor(self._prep_pool, image_data_url,
+                                                   img, self._max_side, self._local_api)
+    def _store_caption(self, run, img, txt, key, caption, written=False):
+        # no fsync per caption: the checkpoint line below is synced and restores it after a crash
+        if not written:
+            write_atomic(txt, caption, fsync=False)
+        run.ckpt.write(json.dumps({"image_path": img, "key": key, "caption": caption}) + "\n")
+        run.ckpt.flush()
+        os.fsync(run.ckpt.fileno())
+        run.index[img.rpartition(os.sep)[2]] = [os.stat(img).st_mtime_ns, os.stat(txt).st_mtime_ns]
+        run.done += 1
     # ---------------- CLEAN EXIT ----------------
     def on_close(self):
+        self.flush_caption()
+        if self._cfg_timer:
+            self.root.after_cancel(self._cfg_timer)
+        self.config.save_now()
         if self.server_proc:
             self.stop_server()
+        self._thumb_pool.shutdown(wait=False, cancel_futures=True)
+        self._prep_pool.shutdown(wait=False, cancel_futures=True)
+        self._gpu_pool.shutdown(wait=False, cancel_futures=True)
+        self.batch_running = False
+        try:
+            asyncio.run_coroutine_threadsafe(self._http.aclose(), self.loop).result(timeout=2)
+        except Exception:
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        if self._nv_handle:
+            pynvml.nvmlShutdown()
         self.root.destroy()
 
 # ---------------- RUN ----------------